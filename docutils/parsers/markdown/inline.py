@@ -8,6 +8,8 @@ except ImportError:
 
     unichr = chr
 import re
+import sys
+from collections import Counter, OrderedDict
 
 import docutils.nodes
 from docutils.nodes import Text
@@ -89,6 +91,12 @@ def slice_node(node, split):
         raise ValueError('Cannot split {}'.format(repr(node)))
 
 
+def raw_text(children):
+    """Joins the text of a list of nodes, as used for ``rawsource``.
+    """
+    return ''.join(child.astext() for child in children)
+
+
 def slice_node_range(node, start, stop):
     node, right_ = slice_node(node, stop)
     left_, node = slice_node(node, start)
@@ -164,7 +172,7 @@ def match_into(children, expr_text, node_cls, group=1, skip=False):
         left, middle, right = re_partition(children, expr)
         if not middle:
             break
-        node = node_cls('', *middle[group])
+        node = node_cls(raw_text(middle[0]), *middle[group])
         node.skip = skip
         children = left+[node]+right
     return children
@@ -181,9 +189,12 @@ def parse_backslash(children):
     return children
 
 
+ENTITY_EXPR = re.compile(r'&({ents});'.format(ents='|'.join(re.escape(ent)
+                                                           for ent in entitydefs)))
+
+
 def parse_entities(children):
-    expr = re.compile(r'&({ents});'.format(ents='|'.join(re.escape(ent)
-                                                         for ent in entitydefs)))
+    expr = ENTITY_EXPR
     while True:
         left, middle, right = re_partition(children, expr)
         if not middle:
@@ -237,7 +248,7 @@ def parse_images(children):
             attrs['title'] = title
         attrs['alt'] = description
         attrs['uri'] = url
-        node = docutils.nodes.image('', **attrs)
+        node = docutils.nodes.image(raw_text(middle[0]), **attrs)
         node.skip = True
         children = left+[node]+right
     return children
@@ -260,7 +271,7 @@ def parse_links(children):
         if title:
             attrs['title'] = title
         attrs['names'] = docutils.nodes.fully_normalize_name(text)
-        node = docutils.nodes.target('', '', *middle[1], **attrs)
+        node = docutils.nodes.target(raw_text(middle[0]), '', *middle[1], **attrs)
         node.skip = True
         children = left+[node]+right
     return children
@@ -280,18 +291,166 @@ def parse_emphasis_strong(children):
     return children
 
 
+# Each pass with the characters that have to be present for it to match
+PASSES = (
+    (parse_code, '`'),
+    (parse_backslash, '\\'),
+    (parse_entities, '&'),
+    (parse_images, '!'),
+    (parse_links, '['),
+    (parse_emphasis_strong, '*_'),
+)
+TRIGGER_EXPR = re.compile(r'[`\\&!\[*_]')
+
+pass_runs = Counter()
+pass_skips = Counter()
+
+
+def pass_stats():
+    """Returns how often each inline pass was run and skipped.
+    """
+    return dict((func.__name__, {'runs': pass_runs[func.__name__],
+                                 'skips': pass_skips[func.__name__]})
+                for func, triggers in PASSES)
+
+
+def reset_pass_stats():
+    pass_runs.clear()
+    pass_skips.clear()
+
+
+def trigger_chars(children):
+    """Returns the trigger characters in the text the passes can match.
+    """
+    text = ''.join(child.astext() for child in children
+                   if isinstance(child, (Text, docutils.nodes.Inline)) and
+                   not getattr(child, 'skip', False))
+    return set(TRIGGER_EXPR.findall(text))
+
+
 def parse_text_nodes(children):
-    children = parse_code(children)
-    children = parse_backslash(children)
-    children = parse_entities(children)
-    children = parse_images(children)
-    children = parse_links(children)
-    children = parse_emphasis_strong(children)
+    """Runs the inline passes over `children`.
+
+    The text is scanned for the characters each pass needs, and passes whose
+    characters are absent are skipped. Entities can produce such characters,
+    so the text is scanned again after they are replaced.
+    """
+    present = trigger_chars(children)
+    for func, triggers in PASSES:
+        if present.intersection(triggers):
+            pass_runs[func.__name__] += 1
+            children = func(children)
+            if func is parse_entities:
+                present = trigger_chars(children)
+        else:
+            pass_skips[func.__name__] += 1
     return children
 
 
+class ParseCache(object):
+    """Bounded LRU cache of inline parse results.
+
+    Results are keyed by the text of a paragraph's lines and stored as
+    templates; every hit returns fresh copies of the template nodes.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits+self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits)/lookups
+
+    def memory(self):
+        """Returns the approximate size of the cached entries in bytes.
+        """
+        total = sys.getsizeof(self.entries)
+        for key, template in self.entries.items():
+            total += sys.getsizeof(key)+sum(sys.getsizeof(line) for line in key)
+            stack = list(template)
+            while stack:
+                node = stack.pop()
+                total += sys.getsizeof(node)
+                if not isinstance(node, Text):
+                    total += sys.getsizeof(node.__dict__)
+                    stack.extend(node.children)
+        return total
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'memory': self.memory(),
+        }
+
+    def summary(self):
+        """Returns the statistics as one line of text.
+        """
+        return '{} entries, {} hits, {} misses ({:.0%} hit rate), ' \
+            '{} bytes'.format(len(self.entries), self.hits, self.misses,
+                              self.hit_rate, self.memory())
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, children):
+        """Parses `children` like `parse_text_nodes`, using the cache.
+
+        Only lists of text nodes are cached.
+        """
+        if not all(isinstance(child, Text) for child in children):
+            return parse_text_nodes(children)
+        key = tuple(child.astext() for child in children)
+        try:
+            template = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            children = parse_text_nodes(children)
+            template = [child.deepcopy() for child in children]
+        else:
+            self.hits += 1
+            children = [child.deepcopy() for child in template]
+        self.entries[key] = template
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return children
+
+
+cache = None
+
+
+def enable_cache(maxsize=1024):
+    """Caches inline parse results for all documents in this process.
+
+    Returns the `ParseCache`, which reports the hit rate and memory usage.
+    """
+    global cache
+    cache = ParseCache(maxsize)
+    return cache
+
+
+def disable_cache():
+    global cache
+    cache = None
+
+
 def parse_node(node):
-    children = parse_text_nodes(node.children)
+    if cache is not None:
+        children = cache.parse(node.children)
+    else:
+        children = parse_text_nodes(node.children)
     node.clear()
     node += children
     return node
@@ -0,0 +1,358 @@
+"""Memory profiling of the parser
+
+A `MemoryProfile` traces allocations with `tracemalloc` while a document is
+parsed and takes a snapshot at the end of every phase: input decoding, the
+block pass (which runs the inline passes of each paragraph), cleanup and,
+from ``markdown2doctree``, serialization. Each phase records its peak and
+the memory it retained, grouped by the module and function of the parser
+that allocated it.
+
+The same profile enforces an optional per-document memory ceiling, raising
+`MemoryLimitError` as soon as it is exceeded instead of letting the process
+run out of memory.
+
+>>> profile = MemoryProfile(limit=parse_size('512M'))
+>>> profile.start()
+>>> with profile.phase('block pass'):
+...     run_block_pass()
+>>> profile.stop()
+>>> print(profile.report())
+"""
+
+from __future__ import absolute_import, division
+
+import contextlib
+import dis
+import linecache
+import os
+import re
+import sys
+import types
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__all__ = ['MemoryProfile', 'MemoryLimitError', 'parse_size', 'phase']
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Allocations made by the profiler itself
+IGNORED_FILES = frozenset((
+    os.path.splitext(__file__)[0]+'.py',
+    getattr(tracemalloc, '__file__', None),
+    '<frozen importlib._bootstrap>',
+    '<unknown>',
+))
+
+# Subsystem of the parser each of its modules belongs to
+SUBSYSTEMS = {
+    'docutils.parsers.markdown.parser': 'decoding',
+    'docutils.parsers.markdown.states': 'block pass',
+    'docutils.parsers.markdown.spans': 'block pass',
+    'docutils.parsers.markdown.inline': 'inline passes',
+    'docutils.parsers.markdown.writer': 'serialization',
+}
+
+UNITS = ('B', 'KiB', 'MiB', 'GiB')
+SIZE_EXPR = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([KMG]?)i?B?\s*$', re.I)
+
+
+class MemoryLimitError(MemoryError):
+    """Raised when parsing a document uses more memory than allowed.
+    """
+    def __init__(self, source, phase, used, limit):
+        self.source = source
+        self.phase = phase
+        self.used = used
+        self.limit = limit
+        MemoryError.__init__(
+            self, '{} used {} during {}, over the limit of {}'.format(
+                source or 'Document', format_size(used), phase or 'parsing',
+                format_size(limit)))
+
+
+def parse_size(text):
+    """Returns the number of bytes in a size such as ``'512M'`` or ``'1GiB'``.
+    """
+    match = SIZE_EXPR.match(text)
+    if match is None:
+        raise ValueError('Invalid size {}'.format(repr(text)))
+    number, unit = match.groups()
+    return int(float(number)*1024**' KMG'.index(unit.upper() or ' '))
+
+
+def validate_size(setting, value=None, *args, **kwargs):
+    """Validates a size setting for `docutils.frontend`.
+    """
+    if value is None:
+        value = setting
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return parse_size(value)
+    except ValueError as error:
+        raise LookupError(str(error))
+
+
+def format_size(size):
+    for unit in UNITS:
+        if abs(size) < 1024 or unit == UNITS[-1]:
+            break
+        size /= 1024
+    if unit == 'B':
+        return '{} B'.format(int(size))
+    return '{:.1f} {}'.format(size, unit)
+
+
+class Phase(object):
+    """Memory used by one phase of parsing.
+
+    `peak` is the highest memory in use during the phase and `retained` the
+    memory still in use at its end, both relative to the start of the
+    document. `statistics` lists ``(module, function, size, count)`` for the
+    allocations retained by the phase, largest first.
+    """
+    def __init__(self, name, peak, retained, statistics=()):
+        self.name = name
+        self.peak = peak
+        self.retained = retained
+        self.statistics = list(statistics)
+
+    def subsystems(self):
+        """Returns the retained size of the phase by parser subsystem.
+        """
+        sizes = {}
+        for module, function, size, count in self.statistics:
+            subsystem = SUBSYSTEMS.get(module, 'other')
+            sizes[subsystem] = sizes.get(subsystem, 0)+size
+        return sizes
+
+
+class MemoryProfile(object):
+    """Traces the memory used while parsing one document.
+
+    Parameters
+    ----------
+    limit : int, optional
+        Memory in bytes the document may use before `MemoryLimitError` is
+        raised. The limit is checked at every phase boundary and, through
+        `check`, for every line of the block pass.
+    snapshots : bool
+        Take a snapshot at the end of every phase to attribute retained
+        allocations. Without snapshots only the peak and retained totals
+        are recorded.
+    frames : int, optional
+        Traceback depth to trace. Attributing allocations made in docutils
+        or the standard library to the parser function below them takes
+        several frames, but every frame slows tracing down, so only one is
+        traced by default when no snapshots are taken.
+    source : str, optional
+        Name of the document for error messages and reports.
+    """
+    def __init__(self, limit=None, snapshots=True, frames=None, source=None):
+        self.limit = limit
+        self.snapshots = snapshots
+        if frames is None:
+            frames = 10 if snapshots else 1
+        self.frames = frames
+        self.source = source
+        self.phases = []
+        self.baseline = 0
+        self.current_phase = None
+        self._started = False
+        self._snapshot = None
+        self._functions = {}
+        self._modules = None
+        self._package_files = {}
+
+    @classmethod
+    def from_settings(cls, settings, source=None):
+        """Returns the profile configured by the ``markdown_memory_limit``
+        and ``markdown_memory_profile`` settings, or None.
+        """
+        limit = getattr(settings, 'markdown_memory_limit', None)
+        snapshots = getattr(settings, 'markdown_memory_profile', False)
+        if limit is None and not snapshots:
+            return None
+        return cls(limit, snapshots, source=source)
+
+    @property
+    def peak(self):
+        return max([phase.peak for phase in self.phases] or [0])
+
+    def start(self):
+        """Starts tracing, unless tracemalloc is already tracing.
+        """
+        if tracemalloc is None:
+            raise RuntimeError('Memory profiling requires tracemalloc')
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+        if self.snapshots:
+            self._snapshot = tracemalloc.take_snapshot()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        """Stops tracing if this profile started it.
+        """
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        self._snapshot = None
+
+    def check(self):
+        """Raises `MemoryLimitError` if the document uses too much memory.
+        """
+        if self.limit is None:
+            return
+        used = tracemalloc.get_traced_memory()[0]-self.baseline
+        if used > self.limit:
+            raise MemoryLimitError(self.source, self.current_phase, used,
+                                   self.limit)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Records the memory used by the body of the ``with`` statement.
+        """
+        start = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.current_phase = name
+        try:
+            yield self
+        finally:
+            self.current_phase = None
+        current, peak = tracemalloc.get_traced_memory()
+        peak -= self.baseline
+        statistics = ()
+        if self.snapshots:
+            statistics = self.statistics()
+            # The snapshot kept for the next phase and the caches used to
+            # read it do not count
+            self.baseline += tracemalloc.get_traced_memory()[0]-current
+        self.phases.append(Phase(name, peak, current-start, statistics))
+        if self.limit is not None and peak > self.limit:
+            raise MemoryLimitError(self.source, name, peak, self.limit)
+
+    def statistics(self):
+        """Returns the allocations retained since the last snapshot, by
+        function, and takes a new snapshot.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        previous, self._snapshot = self._snapshot, snapshot
+        groups = {}
+        for diff in snapshot.compare_to(previous, 'traceback'):
+            if not diff.size_diff and not diff.count_diff:
+                continue
+            key = self.owner(diff.traceback)
+            if key is None:
+                continue
+            size, count = groups.get(key, (0, 0))
+            groups[key] = size+diff.size_diff, count+diff.count_diff
+        statistics = [key+value for key, value in groups.items()]
+        statistics.sort(key=lambda entry: -abs(entry[2]))
+        return statistics
+
+    def owner(self, traceback):
+        """Returns ``(module, function)`` responsible for an allocation.
+
+        That is the most recent frame in this package, or the most recent
+        frame if the package is not involved. Returns None for allocations
+        of the profiler itself.
+        """
+        frames = list(traceback)
+        if sys.version_info >= (3, 7):
+            # Tracebacks are sorted oldest first since Python 3.7
+            frames.reverse()
+        frame = frames[0]
+        for candidate in frames:
+            filename = candidate.filename
+            if filename in IGNORED_FILES:
+                return None
+            in_package = self._package_files.get(filename)
+            if in_package is None:
+                in_package = self._package_files[filename] = \
+                    os.path.dirname(os.path.abspath(filename)) == PACKAGE_DIR
+            if in_package:
+                frame = candidate
+                break
+        return (self.module_name(frame.filename),
+                self.function_name(frame.filename, frame.lineno))
+
+    def module_name(self, filename):
+        if self._modules is None:
+            self._modules = {}
+            for name, module in list(sys.modules.items()):
+                path = getattr(module, '__file__', None)
+                if path:
+                    path = os.path.splitext(os.path.abspath(path))[0]
+                    self._modules[path] = name
+        path = os.path.splitext(os.path.abspath(filename))[0]
+        return self._modules.get(path, filename)
+
+    def function_name(self, filename, lineno):
+        """Returns the qualified name of the function at a source line.
+        """
+        functions = self._functions.get(filename)
+        if functions is None:
+            functions = self._functions[filename] = {}
+            try:
+                code = compile(''.join(linecache.getlines(filename)),
+                               filename, 'exec')
+            except (SyntaxError, ValueError):
+                code = None
+            stack = [(code, None)] if code is not None else []
+            while stack:
+                code, name = stack.pop()
+                for offset, line in dis.findlinestarts(code):
+                    if line is not None:
+                        functions[line] = name or '<module>'
+                for const in code.co_consts:
+                    if isinstance(const, types.CodeType):
+                        qualname = const.co_name
+                        if name is not None:
+                            qualname = name+'.'+qualname
+                        # Nested code is visited last, so it wins ties
+                        stack.insert(0, (const, qualname))
+        return functions.get(lineno, '<unknown>')
+
+    def report(self, top=10):
+        """Returns a text report of the phases and their top allocations.
+        """
+        lines = ['Memory profile of {}'.format(self.source or 'document')]
+        if self.limit is not None:
+            lines.append('Limit: {}'.format(format_size(self.limit)))
+        lines.append('')
+        lines.append('{:<16}{:>12}{:>12}'.format('phase', 'peak', 'retained'))
+        for phase in self.phases:
+            lines.append('{:<16}{:>12}{:>12}'.format(
+                phase.name, format_size(phase.peak),
+                format_size(phase.retained)))
+        for phase in self.phases:
+            if not phase.statistics:
+                continue
+            lines.append('')
+            lines.append('{}, retained by subsystem:'.format(phase.name))
+            subsystems = sorted(phase.subsystems().items(),
+                                key=lambda item: -abs(item[1]))
+            for subsystem, size in subsystems:
+                lines.append('  {:>12}  {}'.format(format_size(size),
+                                                   subsystem))
+            lines.append('{}, retained by function:'.format(phase.name))
+            for module, function, size, count in phase.statistics[:top]:
+                lines.append('  {:>12}{:>8}  {}:{}'.format(
+                    format_size(size), count, module, function))
+        return '\n'.join(lines)+'\n'
+
+
+@contextlib.contextmanager
+def phase(profile, name):
+    """Records a phase in `profile`, which may be None.
+    """
+    if profile is None:
+        yield None
+    else:
+        with profile.phase(name):
+            yield profile
@@ -1,25 +1,78 @@
+import sys
 
 import docutils.parsers
 import docutils.statemachine
 
 from docutils.parsers.markdown import states
 from docutils.parsers.markdown import inline
+from docutils.parsers.markdown import memory
 
 
 class Parser(docutils.parsers.Parser):
     supported = ('markdown', 'md')
+    settings_spec = docutils.parsers.Parser.settings_spec + (
+        'Markdown Parser Options',
+        None,
+        (('Abort parsing a document once it uses more than <size> of '
+          'memory, such as 512M. Traces allocations with tracemalloc.',
+          ['--markdown-memory-limit'],
+          {'metavar': '<size>', 'validator': memory.validate_size}),
+         ('Report the memory used by each phase of parsing.',
+          ['--markdown-memory-profile'],
+          {'action': 'store_true'}),
+         ('Cache inline parse results of up to <entries> paragraphs across '
+          'documents. Its statistics are reported as info messages.',
+          ['--markdown-inline-cache'],
+          {'metavar': '<entries>', 'type': 'int'}),)
+    )
 
     def parse(self, inputstring, document):
+        """Parses `inputstring` into `document`.
+
+        The inline cache is enabled when the ``markdown_inline_cache``
+        setting is given, and kept for the following documents.
+
+        A memory profile started by the caller can be passed in as
+        ``document.memory_profile``, so that it also covers what happens
+        after parsing. Otherwise one is created from the settings when
+        needed, and its report is written to the warning stream.
+        """
         self.setup_parse(inputstring, document)
-        self.statemachine = states.MarkdownStateMachine.create()
+        cache_size = getattr(document.settings, 'markdown_inline_cache', None)
+        if cache_size and (inline.cache is None or
+                           inline.cache.maxsize != cache_size):
+            inline.enable_cache(cache_size)
+        profile = getattr(document, 'memory_profile', None)
+        owned = profile is None
+        if owned:
+            profile = memory.MemoryProfile.from_settings(
+                document.settings, document.get('source'))
+            if profile is not None:
+                profile.start()
         try:
-            inputstring = unicode(inputstring.decode('utf-8'))
-        except UnicodeEncodeError:
-            pass
-        inputlines = docutils.statemachine.string2lines(
-            inputstring,
-            convert_whitespace=True
-        )
-        self.statemachine.run(inputlines, context=document)
-        inline.cleanup(document)
+            with memory.phase(profile, 'decoding'):
+                if isinstance(inputstring, bytes):
+                    inputstring = inputstring.decode('utf-8')
+                inputlines = docutils.statemachine.string2lines(
+                    inputstring,
+                    convert_whitespace=True
+                )
+            with memory.phase(profile, 'block pass'):
+                self.statemachine = states.MarkdownStateMachine.create()
+                if profile is not None and profile.limit is not None:
+                    self.statemachine.memory = profile
+                self.statemachine.run(inputlines, context=document)
+            with memory.phase(profile, 'cleanup'):
+                inline.cleanup(document)
+        finally:
+            if owned and profile is not None:
+                profile.stop()
+        if owned and profile is not None:
+            document.memory_profile = profile
+            if profile.snapshots:
+                stream = getattr(document.reporter, 'stream', None)
+                (stream or sys.stderr).write(profile.report())
+        if cache_size:
+            document.reporter.info('Inline cache: {}'.format(
+                inline.cache.summary()))
         self.finish_parse()
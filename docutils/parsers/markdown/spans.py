@@ -0,0 +1,144 @@
+"""Source spans of generated nodes
+
+Spans are kept in a side table attached to the document as ``span_table``
+instead of on the nodes themselves, so recording them stays cheap enough to
+leave on for large documents.
+
+>>> table = SpanTable()
+>>> node = docutils.nodes.paragraph()
+>>> table.add(node, 3, 0, 4, 12)
+>>> table.span(node)
+(3, 0, 4, 12)
+"""
+
+from __future__ import absolute_import
+
+from array import array
+from bisect import bisect_right
+
+import docutils.nodes
+
+__all__ = ['SpanTable', 'get_span']
+
+
+class SpanTable(object):
+    """Compact table of source spans, indexed by node order.
+
+    Every recorded node takes four ints in a flat `array`: its start line,
+    start column, end line and end column. Lines are 1-based like
+    `docutils.nodes.Node.line`; columns are 0-based and the end column is
+    exclusive.
+    """
+    fields = 4
+
+    def __init__(self, source=None):
+        self.source = source
+        self.nodes = []
+        self.offsets = array('i')
+        self._index = {}
+        self._indexed = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node, line, column, end_line, end_column):
+        """Records the span of `node`.
+
+        Recording a node again replaces its previous span.
+        """
+        self.nodes.append(node)
+        self.offsets.extend((line, column, end_line, end_column))
+
+    def copy(self, node, new_node):
+        """Gives `new_node` the span of `node`, if it has one.
+        """
+        span = self.span(node)
+        if span is not None:
+            self.add(new_node, *span)
+
+    def index(self, node):
+        """Returns the position of `node` in the table or None.
+
+        The lookup dict is only built when spans are queried, and only for
+        the nodes recorded since the last query.
+        """
+        nodes = self.nodes
+        for idx in range(self._indexed, len(nodes)):
+            self._index[id(nodes[idx])] = idx
+        self._indexed = len(nodes)
+        return self._index.get(id(node))
+
+    def span(self, node):
+        """Returns ``(line, column, end_line, end_column)`` for `node`.
+
+        Returns None if the node was not recorded.
+        """
+        idx = self.index(node)
+        if idx is None:
+            return None
+        start = idx*self.fields
+        return tuple(self.offsets[start:start+self.fields])
+
+    def add_inline(self, node, lines, line, column=0):
+        """Records the spans of the inline elements below `node`.
+
+        Inline elements are located by searching for their ``rawsource`` in
+        the paragraph text. Elements that cannot be found (such as markup
+        nested around other markup) are given the span of their parent.
+
+        Parameters:
+
+        - `node`: `docutils.nodes.Element`, after inline parsing
+        - `lines` : list(str), the text of `node` per source line
+        - `line` : int, line of the first entry of `lines`
+        - `column` : int, column of every entry of `lines`
+        """
+        if not any(isinstance(child, docutils.nodes.Inline)
+                   for child in node.children):
+            return
+        starts = []
+        total = 0
+        for entry in lines:
+            starts.append(total)
+            total += len(entry)
+        text = ''.join(lines)
+
+        def position(offset):
+            idx = bisect_right(starts, offset)-1
+            return line+idx, column+offset-starts[idx]
+
+        def add_children(parent, cursor, fallback):
+            for child in parent.children:
+                if not isinstance(child, docutils.nodes.Inline):
+                    continue
+                raw = child.rawsource or child.astext()
+                found = text.find(raw, cursor) if raw else -1
+                if found < 0:
+                    span = fallback
+                    child_cursor = cursor
+                else:
+                    cursor = found+len(raw)
+                    end_line, end_column = position(cursor-1)
+                    span = position(found)+(end_line, end_column+1)
+                    child_cursor = found
+                self.add(child, *span)
+                add_children(child, child_cursor, span)
+
+        if text:
+            end_line, end_column = position(len(text)-1)
+            add_children(node, 0, position(0)+(end_line, end_column+1))
+
+
+def get_span(node):
+    """Returns the span of `node` from its document's span table.
+
+    Returns None if the node is not part of a parsed markdown document or
+    was not recorded.
+    """
+    root = node
+    while root.parent is not None:
+        root = root.parent
+    table = getattr(root, 'span_table', None)
+    if table is None:
+        return None
+    return table.span(node)
@@ -5,14 +5,22 @@
 
 from __future__ import absolute_import
 
+import hashlib
+import itertools
 import re
 import warnings
 
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+
 import docutils.nodes
-from docutils.statemachine import StateMachine, State,\
-    TransitionCorrection, TransitionMethodNotFound
+from docutils.statemachine import StateMachine, State, StateMachineError,\
+    StringList, TransitionMethodNotFound
 
 from . import inline as inline_markdown
+from .spans import SpanTable
 
 __all__ = ['MarkdownStateMachine']
 
@@ -26,10 +34,7 @@ def state(cls):
     return cls
 
 
-def indent(line, indent=0, lazy=False, indent_chars=None):
-    if indent_chars is not None:
-        if line.strip('\t ').startswith(indent_chars):
-            line = line.replace(indent_chars, ' ', 1)
+def indent(line, indent=0, lazy=False):
     if not line.strip('\t '):
         return ''
     if not indent:
@@ -43,15 +48,198 @@ def indent(line, indent=0, lazy=False, indent_chars=None):
     return line[indent:]
 
 
+def loosen(node):
+    """Marks a list as loose.
+
+    Items that were already tightened get their paragraphs back, so each list
+    is restored at most once. The inline content moves back into the
+    paragraph, which no longer holds it since the inline node adopted it.
+    """
+    if node.tight:
+        node.tight = False
+        for item, paragraph, inline in node.tightened:
+            children = inline.children
+            inline.children = []
+            paragraph.children = []
+            paragraph.extend(children)
+            item.replace(inline, paragraph)
+        node.tightened = []
+
+
+def nested_sections(node):
+    """Returns the sections below `node` that are not inside another section.
+    """
+    sections = []
+    stack = node.children[::-1]
+    while stack:
+        child = stack.pop()
+        if isinstance(child, docutils.nodes.section):
+            sections.append(child)
+        elif isinstance(child, docutils.nodes.Element) and \
+                not isinstance(child, docutils.nodes.TextElement):
+            stack.extend(child.children[::-1])
+    return sections
+
+
+class ListTail(MutableSequence):
+    """The items of a list from `start` onwards, without copying them.
+
+    Changes are made to the list itself, and `changed` is called after each
+    of them. Slices have to be contiguous and return lists.
+    """
+    def __init__(self, values, start=0, changed=None):
+        self.values = values
+        self.start = start
+        self.changed = changed
+
+    def _index(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            assert step == 1, 'cannot handle slice with stride'
+            return slice(start+self.start, max(start, stop)+self.start)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return idx+self.start
+
+    def _changed(self):
+        if self.changed is not None:
+            self.changed()
+
+    def __len__(self):
+        return len(self.values)-self.start
+
+    def __iter__(self):
+        return itertools.islice(self.values, self.start, None)
+
+    def __getitem__(self, idx):
+        return self.values[self._index(idx)]
+
+    def __setitem__(self, idx, value):
+        self.values[self._index(idx)] = value
+        self._changed()
+
+    def __delitem__(self, idx):
+        del self.values[self._index(idx)]
+        self._changed()
+
+    def insert(self, idx, value):
+        idx = min(max(idx+len(self) if idx < 0 else idx, 0), len(self))
+        self.values.insert(idx+self.start, value)
+        self._changed()
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return list(self) != list(other)
+
+    def __lt__(self, other):
+        return list(self) < list(other)
+
+    def __le__(self, other):
+        return list(self) <= list(other)
+
+    def __gt__(self, other):
+        return list(self) > list(other)
+
+    def __ge__(self, other):
+        return list(self) >= list(other)
+
+
+class LineView(StringList):
+    """The lines of a `StringList` from `start` onwards.
+
+    Nested statemachines read their input through a view, so that entering
+    one does not copy the remainder of the document. Its `data` and `items`
+    are `ListTail` views of those of the underlying `StringList`, so changes
+    made through any view, including trims, change the underlying lines and
+    are seen by every other view of them. Slicing returns a child
+    `StringList` as usual.
+    """
+    def __init__(self, lines, start=0):
+        if isinstance(lines, LineView):
+            start += lines.start
+            self.markers = lines.markers
+            lines = lines.lines
+        else:
+            self.markers = {}
+        StringList.__init__(self)
+        self.lines = lines
+        self.start = start
+        self.data = ListTail(lines.data, start, self.markers.clear)
+        self.items = ListTail(lines.items, start)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            return StringList(self.data[idx], items=self.items[idx],
+                              parent=self, parent_offset=start)
+        if idx >= 0:
+            # Read once for every line, so this skips `ListTail`
+            return self.data.values[idx+self.start]
+        return self.data[idx]
+
+    def __add__(self, other):
+        return StringList(self)+other
+
+    def __radd__(self, other):
+        return other+StringList(self)
+
+    def __mul__(self, n):
+        return StringList(self)*n
+
+    __rmul__ = __mul__
+
+    def quote_markers(self, idx, base=0):
+        """Returns the offsets after each block quote marker of a line.
+
+        Markers are counted from column `base`, once per line, and shared
+        by every view of the same lines. Each offset is where the content
+        of that quote level starts.
+        """
+        key = (idx+self.start, base)
+        try:
+            return self.markers[key]
+        except KeyError:
+            pass
+        line = self.lines.data[idx+self.start]
+        markers = []
+        pos = base
+        while True:
+            stripped = line[pos:pos+4].lstrip(' ')
+            if not stripped.startswith('>'):
+                break
+            pos += 4-len(stripped)+1
+            if line[pos:pos+1] == ' ':
+                pos += 1
+            markers.append(pos)
+        markers = tuple(markers)
+        self.markers[key] = markers
+        return markers
+
+
 class MarkdownStateMachine(StateMachine):
     """Markdown master StateMachine
     """
     def __init__(self, state_classes, initial_state, debug=False, indent=0,
-                 indent_chars=None):
+                 spans=None, marker=False, quotes=(), memory=None):
         StateMachine.__init__(self, state_classes, initial_state, debug)
         self.indent = indent
-        self.indent_chars = indent_chars
+        self.marker = marker
+        self.quotes = quotes
         self.lazy = False
+        if spans is None:
+            spans = SpanTable()
+        self.spans = spans
+        self.memory = memory
 
     @classmethod
     def create(cls):
@@ -62,6 +250,10 @@ class MarkdownStateMachine(StateMachine):
             input_source=None, initial_state=None):
         """Runs this state machine.
 
+        `StateMachine.run` would copy `input_lines` into a new `StringList`
+        unless it already is one, so they are wrapped in a `LineView` that
+        it reads in place.
+
         Parameters:
 
         - `input_lines`: list(str)
@@ -70,13 +262,50 @@ class MarkdownStateMachine(StateMachine):
         - `input_source` : str, optional
         - `initial_state` : str
         """
+        if not isinstance(input_lines, LineView):
+            if not isinstance(input_lines, StringList):
+                input_lines = StringList(input_lines, source=input_source)
+            input_lines = LineView(input_lines)
         return StateMachine.run(self, input_lines, input_offset, context,
                                 input_source, initial_state)
 
+    def quote_offset(self, line_offset):
+        """Returns where the content of a line starts inside its quotes.
+
+        `quotes` holds ``(indent, depth)`` for every run of directly nested
+        block quotes, where `indent` is the indent of the enclosing content
+        before the first marker of the run. Markers of each run are counted
+        from the content of the previous one.
+
+        Returns None if the line lacks a quote marker.
+        """
+        start = 0
+        for indent, depth in self.quotes:
+            markers = self.input_lines.quote_markers(line_offset, start+indent)
+            if len(markers) < depth:
+                return None
+            start = markers[depth-1]
+        return start
+
     def next_line(self, nth=1):
+        if self.memory is not None:
+            self.memory.check()
         line = StateMachine.next_line(self, nth)
+        start = self.quote_offset(self.line_offset)
         try:
-            self.line = indent(line, self.indent, self.lazy, self.indent_chars)
+            if start is None:
+                # Only paragraphs continue onto lines outside the quote
+                if not self.lazy or not line.strip('\t '):
+                    raise EOFError('Unquoted')
+                self.line = line.lstrip(' >')
+                return self.line
+            if start:
+                line = line[start:]
+            if self.marker and not self.line_offset:
+                # The list marker on the first line is covered by the indent
+                self.line = line[self.indent:]
+                return self.line
+            self.line = indent(line, self.indent, self.lazy)
         except EOFError:
             self.line_offset -= nth
             self.line = None
@@ -114,30 +343,157 @@ class MarkdownBaseState(State):
         self.state_machine.previous_line()
         raise EOFError
 
-    def enter(self, context, next_state, nth=0, indent=0, **kwargs):
+    def position(self):
+        """Returns the line and column where the current line starts.
+        """
+        state_machine = self.state_machine
+        line = state_machine.line or ''
+        column = state_machine.indent+len(line)-len(line.lstrip(' '))
+        column += state_machine.quote_offset(state_machine.line_offset) or 0
+        return state_machine.abs_line_offset()+1, column
+
+    def mark(self, node, line, column, end=None):
+        """Records the span of `node` in the document's span table.
+
+        Parameters:
+
+        - `node`: `docutils.nodes.Node`
+        - `line` : int, start line as returned by `position`
+        - `column` : int
+        - `end` : int, optional, absolute offset of the last line of the
+          node. Defaults to the current line.
+        """
+        state_machine = self.state_machine
+        input_lines = state_machine.input_lines
+        if end is None:
+            end = state_machine.abs_line_offset()
+        end = min(end, state_machine.input_offset+len(input_lines)-1)
+        end_column = len(input_lines[end-state_machine.input_offset])
+        state_machine.spans.add(node, line, column, end+1, end_column)
+
+    def enter(self, context, next_state, nth=0, indent=0, marker=False,
+              quote=False):
         """Enters a nested statemachine.
 
+        The span of `context` is recorded from the current line up to the
+        last line consumed by the nested statemachine.
+
         Parameters:
 
         - `context`: `docutils.nodes.Node`
         - `next_state` : str
+        - `nth` : int, lines to skip before the nested statemachine starts
+        - `indent` : int, indent of the nested statemachine relative to
+          this one
+        - `marker` : bool, whether the first line starts with a list marker
+          covered by `indent`
+        - `quote` : bool, whether the nested statemachine reads the content
+          of one more level of block quote
         """
-        sm_kwargs = self.nested_sm_kwargs.copy()
-        input_offset = self.state_machine.abs_line_offset()
-        ofs = self.state_machine.line_offset+nth
-        self.state_machine.next_line(nth)
-        input_lines = self.state_machine.input_lines[ofs:]
-        sm_kwargs['debug'] = self.state_machine.debug
-        sm_kwargs['indent'] = self.state_machine.indent+indent
-        sm_kwargs.update(kwargs)
-        substate_machine = self.nested_sm(**sm_kwargs)
+        state_machine = self.state_machine
+        line, column = self.position()
+        current = state_machine.abs_line_offset()
+        input_offset = current+nth
+        ofs = state_machine.line_offset+nth
+        state_machine.next_line(nth)
+        input_lines = LineView(state_machine.input_lines, ofs)
+        quotes = state_machine.quotes
+        if quote:
+            indent = state_machine.indent
+            if quotes and not indent:
+                indent, depth = quotes[-1]
+                quotes = quotes[:-1]+((indent, depth+1),)
+            else:
+                quotes += ((indent, 1),)
+            indent = 0
+        else:
+            indent += state_machine.indent
+            if state_machine.marker and not ofs:
+                # Still on the line of the list marker
+                marker = True
+        substate_machine = self.nested_machine(indent, marker, quotes)
         results = substate_machine.run(
             input_lines, input_offset,
             context=context, initial_state=next_state
         )
-        self.state_machine.goto_line(substate_machine.abs_line_offset())
+        end = substate_machine.abs_line_offset()
+        if end < current:
+            # The current line would be dispatched again forever
+            raise StateMachineError(
+                'Nested {} state consumed no input at line {}'.format(
+                    next_state, line))
+        self.mark(context, line, column, end)
+        self.state_machine.goto_line(end)
         return results
 
+    def nested_machine(self, indent=0, marker=False, quotes=()):
+        """Returns the nested statemachine for this state.
+
+        The statemachine is created on first use and reused afterwards,
+        since a state never enters a second one before the first finishes.
+        """
+        substate_machine = self.__dict__.get('substate_machine')
+        if substate_machine is None:
+            sm_kwargs = self.nested_sm_kwargs.copy()
+            sm_kwargs['debug'] = self.state_machine.debug
+            sm_kwargs['spans'] = self.state_machine.spans
+            sm_kwargs['memory'] = self.state_machine.memory
+            substate_machine = self.nested_sm(**sm_kwargs)
+            self.substate_machine = substate_machine
+        substate_machine.indent = indent
+        substate_machine.marker = marker
+        substate_machine.quotes = quotes
+        substate_machine.lazy = False
+        return substate_machine
+
+    def scan_code(self, offset, width=0, opening=None):
+        """Consumes a code block without entering a nested statemachine.
+
+        The block runs until the closing fence (if `opening` is given) or
+        the first line that is not indented by `width`, and is taken from
+        the input buffer as a single slice. The statemachine is left on the
+        last line of the block.
+
+        Parameters:
+
+        - `offset`: int, first line of the block
+        - `width` : int, indentation to remove from each line
+        - `opening` : str, optional, the fence that opened the block
+
+        Returns the text of the block.
+        """
+        state_machine = self.state_machine
+        input_lines = state_machine.input_lines
+        marker = state_machine.marker
+        starts = []
+        end = last = len(input_lines)
+        for idx in range(offset, end):
+            line = input_lines[idx]
+            start = 0
+            if state_machine.quotes:
+                start = state_machine.quote_offset(idx)
+                if start is None:
+                    end = last = idx
+                    break
+                starts.append(start)
+                line = line[start:]
+            if width and line[:width].strip(' ') and (idx or not marker):
+                end = last = idx
+                break
+            if opening is not None:
+                stripped = line[width:].lstrip(' ')
+                if stripped.startswith(opening) and \
+                        len(line)-len(stripped)-width <= 3:
+                    end, last = idx, idx+1
+                    break
+        lines = input_lines[offset:end]
+        if starts:
+            lines = [line[start+width:] for line, start in zip(lines, starts)]
+        elif width:
+            lines = [line[width:] for line in lines]
+        self.state_machine.goto_line(self.state_machine.input_offset+last-1)
+        return '\n'.join(lines)
+
 
 @state
 class Section(MarkdownBaseState):
@@ -158,18 +514,27 @@ class Section(MarkdownBaseState):
         """
         node = docutils.nodes.transition()
         context.append(node)
+        self.mark(node, *self.position())
         return context, next_state, []
 
     def section(self, match, context, next_state):
         level = match.group(1).count('#')
         text = match.group(2).lstrip()
         supersection = context
+        super_level = 0
         # Find the node that is actually a true section or root Body
         while not hasattr(supersection, 'section_level'):
+            if isinstance(supersection, (docutils.nodes.block_quote,
+                                         docutils.nodes.list_item)):
+                # Headings cannot close sections outside of their container
+                break
             supersection = supersection.parent
-        if level <= supersection.section_level:
+        else:
+            super_level = supersection.section_level
+        if level <= super_level:
+            self.state_machine.previous_line()
             raise EOFError()
-        if level != supersection.section_level+1:
+        if level != super_level+1:
             warnings.warn('Section is not properly nested', UserWarning)
         subcontext = docutils.nodes.section()
         subcontext.section_level = level
@@ -178,28 +543,72 @@ class Section(MarkdownBaseState):
         context.append(subcontext)
         header = docutils.nodes.title(text=text)
         subcontext.append(header)
-        return context, next_state, self.enter(subcontext, 'Section', nth=1)
+        self.mark(header, *self.position())
+        start = end = self.state_machine.abs_line_offset()
+        try:
+            results = self.enter(subcontext, 'Section', nth=1)
+        finally:
+            span = self.state_machine.spans.span(subcontext)
+            if span is not None:
+                end = span[2]-1
+            self.fingerprint(subcontext, start, end)
+        return context, next_state, results
+
+    def fingerprint(self, node, start, end):
+        """Stores a digest of the source lines of `node` as ``node.digest``.
+
+        Sections nested in `node` contribute their own digest instead of
+        their lines, so digests roll up from nested sections to parents.
+
+        Parameters:
+
+        - `node`: `docutils.nodes.Element`
+        - `start` : int, absolute offset of the first line
+        - `end` : int, absolute offset of the last line
+        """
+        input_lines = self.state_machine.input_lines
+        base = self.state_machine.input_offset
+        digest = hashlib.sha1()
+        offset = start
+        for section in nested_sections(node):
+            span = self.state_machine.spans.span(section)
+            if span is None:
+                continue
+            for line in input_lines[offset-base:span[0]-1-base]:
+                digest.update(line.encode('utf-8')+b'\n')
+            digest.update(section.digest.encode('ascii'))
+            offset = span[2]
+        for line in input_lines[offset-base:end+1-base]:
+            digest.update(line.encode('utf-8')+b'\n')
+        node.digest = digest.hexdigest()
 
     def code_block(self, match, context, next_state):
-        node = docutils.nodes.literal_block()
-        node.opening = None
-        return context, next_state, self.enter(node, 'Code', indent=4)
+        line, column = self.position()
+        width = self.state_machine.indent+4
+        text = self.scan_code(self.state_machine.line_offset, width)
+        node = docutils.nodes.literal_block(text, text)
+        context.append(node)
+        self.mark(node, line, column)
+        return context, next_state, []
 
     def fence(self, match, context, next_state):
         opening = match.group(1)
         lang = match.string[match.end(1):].strip()
-        node = docutils.nodes.literal_block()
+        line, column = self.position()
+        width = self.state_machine.indent
+        text = self.scan_code(self.state_machine.line_offset+1, width, opening)
+        node = docutils.nodes.literal_block(text, text)
         if lang:
             lang = lang.split(' ')[0]
             node['classes'].append(lang)
-        node.opening = opening
-        return context, next_state, self.enter(node, 'Code', nth=1)
+        context.append(node)
+        self.mark(node, line, column)
+        return context, next_state, []
 
     def block_quote(self, match, context, next_state):
         node = docutils.nodes.block_quote()
-        mark_len = match.end()
-        return context, next_state, self.enter(node, 'Section', indent=mark_len,
-                                               indent_chars='>')
+        context.append(node)
+        return context, next_state, self.enter(node, 'Section', quote=True)
 
     def paragraph(self, match, context, next_state):
         node = docutils.nodes.paragraph()
@@ -231,8 +640,30 @@ class Body(Section):
     def bof(self, context):
         context, result = MarkdownBaseState.bof(self, context)
         context.section_level = 0
+        context.span_table = self.state_machine.spans
+        context.span_table.source = context.get('source')
         return context, result
 
+    def eof(self, context):
+        """Stores the digest of the whole input on the document.
+
+        ``section_digests`` maps the first id of every section to the list
+        of digests of the sections with that id, in document order, since
+        repeated headings share their ids.
+        """
+        start = self.state_machine.input_offset
+        end = start+len(self.state_machine.input_lines)-1
+        self.fingerprint(context, start, end)
+        context.section_digests = {}
+        sections = nested_sections(context)[::-1]
+        while sections:
+            section = sections.pop()
+            if section['ids']:
+                context.section_digests.setdefault(
+                    section['ids'][0], []).append(section.digest)
+            sections.extend(nested_sections(section)[::-1])
+        return []
+
 
 @state
 class Paragraph(MarkdownBaseState):
@@ -240,6 +671,7 @@ class Paragraph(MarkdownBaseState):
         'thematic_break',
         'section',
         'fence',
+        'block_quote',
         'ulist',
         'olist_only_one',
         'blank',
@@ -252,7 +684,12 @@ class Paragraph(MarkdownBaseState):
         return context, result
 
     def eof(self, context):
+        lines = context.children[:]
         inline_markdown.parse_node(context)
+        self.state_machine.spans.add_inline(
+            context, lines, self.state_machine.input_offset+1,
+            self.state_machine.indent+(self.state_machine.quote_offset(0) or 0)
+        )
         return []
 
     def paragraph(self, match, context, next_state):
@@ -261,34 +698,6 @@ class Paragraph(MarkdownBaseState):
         return context, next_state, []
 
 
-@state
-class Code(MarkdownBaseState):
-    initial_transitions = (
-        'fence',
-        'blank',
-        'paragraph',
-    )
-
-    def eof(self, context):
-        joined = '\n'.join(context.children)
-        context.clear()
-        context.append(docutils.nodes.Text(joined))
-        return []
-
-    def fence(self, match, context, next_state):
-        opening = match.group(1)
-        if context.opening and context.opening in opening:
-            self.state_machine.next_line()
-            raise EOFError('End fence found')
-        else:
-            raise TransitionCorrection('paragraph')
-
-    def paragraph(self, match, context, next_state):
-        context.append(docutils.nodes.Text(match.string))
-        return context, next_state, []
-    blank = paragraph
-
-
 @state
 class UListContainer(MarkdownBaseState):
     initial_transitions = (
@@ -298,38 +707,30 @@ class UListContainer(MarkdownBaseState):
 
     def bof(self, context):
         context.tight = True
+        context.tightened = []
+        context.blank_end = False
         return context, []
 
-    def eof(self, context):
-        if context.tight:
-            # For tight lists, replace paragraphs with their contents directly
-            for subnode in context.children[:]:
-                if subnode.children:
-                    child = subnode.children[0]
-                    if isinstance(child, docutils.nodes.paragraph):
-                        new_child = docutils.nodes.inline('', '', *child.children)
-                        subnode.replace(child, new_child)
-        return []
-
     def no_match(self, context, transitions):
+        self.state_machine.previous_line()
         raise EOFError
 
     def blank(self, match, context, next_state):
-        context.tight = False
+        loosen(context)
         return context, next_state, []
 
     def list_item(self, match, context, next_state):
+        if context.blank_end:
+            # The previous item ended with a blank line
+            loosen(context)
         node = docutils.nodes.list_item()
         context.append(node)
-        mark_len = match.end()
-        # FIXME: Negative indents will force new list
-        self.state_machine.indent += match.start(1)
-        line = ' '*mark_len+match.string[mark_len:]
-        self.state_machine.input_lines[self.state_machine.line_offset] = line
-        return context, next_state, self.enter(node, 'ListItem', indent=mark_len)
+        return context, next_state, self.enter(node, 'ListItem',
+                                               indent=match.end(), marker=True)
 
     def ulist(self, match, context, next_state):
         if match.group(1) != context['bullet']:
+            self.state_machine.previous_line()
             raise EOFError('New list')
         return self.list_item(match, context, next_state)
 
@@ -343,18 +744,32 @@ class OListContainer(UListContainer):
 
     def olist(self, match, context, next_state):
         if match.group(2) != context.delimiter:
+            self.state_machine.previous_line()
             raise EOFError('New list')
         return self.list_item(match, context, next_state)
 
 
 @state
 class ListItem(Section):
+    def eof(self, context):
+        container = context.parent
+        if container.tight and context.children:
+            # Tight lists hold the contents of their paragraphs directly
+            child = context.children[0]
+            if isinstance(child, docutils.nodes.paragraph):
+                new_child = docutils.nodes.inline('', '', *child.children)
+                context.replace(child, new_child)
+                self.state_machine.spans.copy(child, new_child)
+                container.tightened.append((context, child, new_child))
+        return []
+
     def blank(self, match, context, next_state):
+        context.parent.blank_end = False
         try:
             self.state_machine.next_line()
         except EOFError:
-            pass
+            context.parent.blank_end = True
         else:
             self.state_machine.previous_line()
-            context.parent.tight = False
+            loosen(context.parent)
         return context, next_state, []
@@ -0,0 +1,138 @@
+"""Streaming doctree output
+
+The doctree is walked without recursion and written to a binary file
+object in buffered chunks, instead of being built into one string first.
+"""
+
+from __future__ import absolute_import
+
+import gzip
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+import docutils.nodes
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+__all__ = ['write', 'FORMATS']
+
+START = 'start'
+TEXT = 'text'
+END = 'end'
+
+
+def walk(node):
+    """Yields ``(event, node, level)`` for the tree below `node`.
+
+    Events are START and END around elements and TEXT for text nodes, in
+    document order.
+    """
+    stack = [(None, iter((node,)))]
+    while stack:
+        parent, children = stack[-1]
+        for child in children:
+            if isinstance(child, docutils.nodes.Text):
+                yield TEXT, child, len(stack)-1
+            else:
+                yield START, child, len(stack)-1
+                stack.append((child, iter(child.children)))
+                break
+        else:
+            stack.pop()
+            if parent is not None:
+                yield END, parent, len(stack)-1
+
+
+def pseudoxml_chunks(node):
+    """Yields the same text as ``str(node)``, followed by a newline.
+    """
+    for event, child, level in walk(node):
+        if event is TEXT:
+            yield text_type(child)
+        elif not child.children:
+            if event is START:
+                yield child.emptytag()
+        elif event is START:
+            yield child.starttag()
+        else:
+            yield child.endtag()
+    yield '\n'
+
+
+def xml_chunks(node):
+    """Yields `node` as an XML document.
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    for event, child, level in walk(node):
+        if event is TEXT:
+            yield escape(text_type(child))
+        elif event is START:
+            yield child.starttag(quoteattr)
+        else:
+            yield child.endtag()
+    yield '\n'
+
+
+def jsonl_chunks(node):
+    """Yields one JSON object per line for each node, in document order.
+
+    Elements have their ``level``, ``tagname`` and ``attributes``; text
+    nodes have their ``level`` and ``text``.
+    """
+    for event, child, level in walk(node):
+        if event is TEXT:
+            record = {'level': level, 'text': text_type(child)}
+        elif event is START:
+            record = {'level': level, 'tagname': child.tagname,
+                      'attributes': child.attributes}
+        else:
+            continue
+        yield json.dumps(record, sort_keys=True, default=text_type)+'\n'
+
+
+FORMATS = {
+    'pseudoxml': pseudoxml_chunks,
+    'xml': xml_chunks,
+    'jsonl': jsonl_chunks,
+}
+
+
+def write(node, stream, format='pseudoxml', compress=False,
+          buffer_size=1 << 16, encoding='utf-8'):
+    """Writes `node` to `stream` as it is walked.
+
+    Parameters
+    ----------
+    node : docutils.nodes.Node
+    stream : file
+        Binary file object to write to. It is not closed.
+    format : str
+        One of FORMATS.
+    compress : bool
+        Write a gzip stream.
+    buffer_size : int
+        Approximate number of characters collected before each write.
+    encoding : str
+    """
+    try:
+        chunks = FORMATS[format]
+    except KeyError:
+        raise ValueError('Unknown format {}'.format(repr(format)))
+    if compress:
+        stream = gzip.GzipFile(fileobj=stream, mode='wb')
+    buffered = []
+    size = 0
+    for chunk in chunks(node):
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            stream.write(''.join(buffered).encode(encoding))
+            buffered = []
+            size = 0
+    if buffered:
+        stream.write(''.join(buffered).encode(encoding))
+    if compress:
+        stream.close()
@@ -0,0 +1,14 @@
+import docutils.utils
+from docutils.parsers.markdown import Parser
+import pytest
+
+
+@pytest.fixture
+def parse():
+    """Returns a function that parses markdown text into a new document.
+    """
+    def parse(text, source='test'):
+        document = docutils.utils.new_document(source)
+        Parser().parse(text, document)
+        return document
+    return parse
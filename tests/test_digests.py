@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+TEXT = '''# First
+
+Intro
+
+## Nested
+
+Nested text
+
+## Other
+
+Other text
+
+# Second
+
+Second text
+'''
+
+
+def test_stable(parse):
+    first = parse(TEXT)
+    second = parse(TEXT)
+    assert first.digest == second.digest
+    assert first.section_digests == second.section_digests
+    assert sorted(first.section_digests) == ['first', 'nested', 'other', 'second']
+    assert first.section_digests['first'] == [first[0].digest]
+
+
+def test_rollup(parse):
+    before = parse(TEXT).section_digests
+    after = parse(TEXT.replace('Nested text', 'Changed text')).section_digests
+    assert before['nested'] != after['nested']
+    assert before['first'] != after['first']
+    assert before['other'] == after['other']
+    assert before['second'] == after['second']
+
+
+def test_duplicate_ids(parse):
+    document = parse('# A\n\n## Examples\n\nOne\n\n# B\n\n## Examples\n\nTwo\n')
+    first = document[0][1]
+    second = document[1][1]
+    assert first.digest != second.digest
+    assert document.section_digests['examples'] == [first.digest,
+                                                    second.digest]
+
+
+def test_document(parse):
+    assert parse(TEXT).digest != parse(TEXT+'\nMore\n').digest
@@ -4,7 +4,8 @@ from __future__ import unicode_literals
 import re
 
 import docutils.nodes
-from docutils.parsers.markdown import inline
+import docutils.utils
+from docutils.parsers.markdown import Parser, inline
 import pytest
 
 
@@ -106,9 +107,10 @@ def test_emphasis(text, doctree):
     (r'***strong emphasis***',
      '<paragraph><strong><emphasis>strong emphasis</emphasis></strong></paragraph>'),
     # works, but has redundant tags
-    pytest.mark.xfail((
+    pytest.param(
         r'**strong and *emphasis* also**',
-        '<paragraph><strong>strong and <emphasis>emphasis</emphasis> also</strong></paragraph>')),
+        '<paragraph><strong>strong and <emphasis>emphasis</emphasis> also</strong></paragraph>',
+        marks=pytest.mark.xfail),
 ])
 def test_strong(text, doctree):
     node = docutils.nodes.paragraph('', docutils.nodes.Text(text))
@@ -127,3 +129,72 @@ def test_links(text, doctree):
     node = docutils.nodes.paragraph('', docutils.nodes.Text(text))
     node = inline.parse_node(node)
     assert str(node) == doctree
+
+
+def test_cache():
+    cache = inline.ParseCache(maxsize=2)
+    text = 'Some *emphasis* and `code`'
+    first = cache.parse([docutils.nodes.Text(text)])
+    second = cache.parse([docutils.nodes.Text(text)])
+    assert cache.hits == cache.misses == 1
+    assert cache.hit_rate == 0.5
+    assert [str(node) for node in first] == [str(node) for node in second]
+    assert all(left is not right for left, right in zip(first, second))
+    cache.parse([docutils.nodes.Text('other')])
+    cache.parse([docutils.nodes.Text('another')])
+    assert len(cache) == 2
+    cache.parse([docutils.nodes.Text(text)])
+    assert cache.misses == 4
+    assert cache.stats()['memory'] > 0
+
+
+def test_enable_cache():
+    cache = inline.enable_cache()
+    try:
+        for _ in range(3):
+            node = docutils.nodes.paragraph('', docutils.nodes.Text('*test*'))
+            node = inline.parse_node(node)
+            assert str(node) == '<paragraph><emphasis>test</emphasis></paragraph>'
+        assert cache.hits == 2
+    finally:
+        inline.disable_cache()
+
+
+def test_pass_pruning():
+    inline.reset_pass_stats()
+    nodes = [docutils.nodes.Text('plain text only')]
+    assert inline.parse_text_nodes(nodes) == nodes
+    node = docutils.nodes.paragraph('', docutils.nodes.Text('some `code` here'))
+    inline.parse_node(node)
+    stats = inline.pass_stats()
+    assert stats['parse_code'] == {'runs': 1, 'skips': 1}
+    assert stats['parse_emphasis_strong'] == {'runs': 0, 'skips': 2}
+
+
+def test_cache_setting():
+    messages = []
+    try:
+        for _ in range(2):
+            document = docutils.utils.new_document('test')
+            document.settings.markdown_inline_cache = 16
+            document.reporter.attach_observer(messages.append)
+            Parser().parse('Some *emphasis*\n', document)
+        assert inline.cache.maxsize == 16
+        assert inline.cache.hits == 1
+    finally:
+        inline.disable_cache()
+    assert 'Inline cache: 1 entries, 1 hits, 1 misses (50% hit rate)' in \
+        messages[-1].astext()
+
+
+
+def test_entity_triggers():
+    node = docutils.nodes.paragraph('', docutils.nodes.Text('&#42;test&#42;'))
+    node = inline.parse_node(node)
+    assert str(node) == '<paragraph><emphasis>test</emphasis></paragraph>'
+    node = docutils.nodes.paragraph(
+        '', docutils.nodes.Text('&#91;Google](http://google.com)'))
+    node = inline.parse_node(node)
+    assert isinstance(node[0], docutils.nodes.target)
+    assert node[0]['refuri'] == 'http://google.com'
+    assert node.astext() == 'Google'
@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+
+import docutils.frontend
+import docutils.utils
+from docutils.parsers.markdown import Parser, memory
+import pytest
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+TEXT = '# Title\n\nSome *text* with `code`\n\n* item\n* item\n\n> quote\n'*20
+
+
+def test_parse_size():
+    assert memory.parse_size('512') == 512
+    assert memory.parse_size('2K') == 2048
+    assert memory.parse_size('1.5 MiB') == 1536*1024
+    assert memory.parse_size('1g') == 1024**3
+    with pytest.raises(ValueError):
+        memory.parse_size('lots')
+
+
+def test_phases():
+    document = docutils.utils.new_document('test')
+    profile = memory.MemoryProfile(source='test')
+    profile.start()
+    document.memory_profile = profile
+    try:
+        Parser().parse(TEXT, document)
+    finally:
+        profile.stop()
+    assert not tracemalloc.is_tracing()
+    assert [phase.name for phase in profile.phases] == [
+        'decoding', 'block pass', 'cleanup']
+    block_pass = profile.phases[1]
+    assert block_pass.peak >= block_pass.retained > 0
+    modules = set(module for module, function, size, count
+                  in block_pass.statistics)
+    assert 'docutils.parsers.markdown.states' in modules
+    assert 'docutils.parsers.markdown.inline' in modules
+    assert block_pass.subsystems()['inline passes'] > 0
+    report = profile.report()
+    assert 'block pass' in report
+    assert 'docutils.parsers.markdown.inline:parse_node' in report
+
+
+def test_limit():
+    document = docutils.utils.new_document('test')
+    document.settings.markdown_memory_limit = 1024
+    with pytest.raises(memory.MemoryLimitError) as error:
+        Parser().parse(TEXT, document)
+    assert not tracemalloc.is_tracing()
+    assert error.value.limit == 1024
+    assert error.value.used > 1024
+    assert 'over the limit of 1.0 KiB' in str(error.value)
+
+
+def test_settings(capsys):
+    document = docutils.utils.new_document('test')
+    document.settings.markdown_memory_profile = True
+    Parser().parse(TEXT, document)
+    assert not tracemalloc.is_tracing()
+    assert len(document.memory_profile.phases) == 3
+    assert 'Memory profile of test' in capsys.readouterr().err
+
+
+def test_settings_spec():
+    settings = docutils.frontend.get_default_settings(Parser)
+    assert settings.markdown_memory_limit is None
+    assert settings.markdown_memory_profile is None
+    assert settings.line_length_limit == 10000
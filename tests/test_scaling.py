@@ -0,0 +1,133 @@
+"""Complexity scaling of the parser
+
+Every family of inputs is parsed at sizes n, 2n, 4n and 8n, and the growth
+exponent of the run time and of the peak traced memory is fitted over those
+sizes. A linear parser has an exponent close to 1; each family fails if it
+grows faster than its bound. Base sizes are chosen so that the smallest run
+takes at least about 20 ms, or the constant cost of a parse would flatten
+the fit.
+"""
+from __future__ import division, unicode_literals
+
+import math
+import timeit
+
+import pytest
+
+SCALES = (1, 2, 4, 8)
+TIME_EXPONENT = 1.3
+QUADRATIC_EXPONENT = 2.3
+MEMORY_EXPONENT = 1.2
+REPEAT = 5
+
+
+def exponent(sizes, values):
+    """Least squares slope of log(values) over log(sizes).
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, 1e-9)) for value in values]
+    x_mean = sum(xs)/len(xs)
+    y_mean = sum(ys)/len(ys)
+    covariance = sum((x-x_mean)*(y-y_mean) for x, y in zip(xs, ys))
+    variance = sum((x-x_mean)**2 for x in xs)
+    return covariance/variance
+
+
+def run_time(parse, text):
+    timer = timeit.Timer(lambda: parse(text))
+    return min(timer.repeat(REPEAT, 1))
+
+
+def peak_memory(parse, text):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    tracemalloc.start()
+    try:
+        parse(text)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def long_paragraph(n):
+    return 'word '*(n*10)+'\n'
+
+
+def paragraph_lines(n):
+    return 'some words on a line\n'*n
+
+
+def marked_lines(n):
+    return 'some words on a line\n'*n+'and *one* span\n'
+
+
+def inline_spans(n):
+    return 'text *em* and `code` '*n+'\n'
+
+
+def deep_list(n):
+    # Nesting depth is bounded by the recursion limit, so each run parses
+    # several lists of depth n to take long enough to measure
+    nested = ''.join('  '*depth+'* item\n' for depth in range(n))
+    return ('Text\n\n'+nested+'\n')*30
+
+
+def long_list(n):
+    return '* item\n'*n
+
+
+def code_fence(n):
+    return '```\n'+'x = 1\n'*n+'```\n'
+
+
+def deep_quote(n):
+    return ('> '*16+'quoted line\n')*n
+
+
+def indented_code(n):
+    return 'Code:\n\n'+'    x = 1\n'*n
+
+
+def sections(n):
+    return ''.join('# Section {}\n\nText\n\n## Sub\n\nMore\n\n'.format(idx)
+                   for idx in range(n))
+
+
+def entities(n):
+    return '&amp; &copy; '*n+'\n'
+
+
+FAMILIES = [
+    (long_paragraph, 20000),
+    (paragraph_lines, 2000),
+    (marked_lines, 2000),
+    (inline_spans, 50),
+    (deep_list, 10),
+    (long_list, 300),
+    (code_fence, 40000),
+    (indented_code, 30000),
+    (deep_quote, 1500),
+    (sections, 120),
+    (entities, 60),
+]
+
+# match_into partitions all children again after every match, so these
+# are only held to a quadratic bound
+QUADRATIC = (inline_spans, entities)
+
+
+@pytest.mark.parametrize('family,size', FAMILIES)
+def test_time(parse, family, size):
+    parse(family(1))
+    sizes = [size*scale for scale in SCALES]
+    times = [run_time(parse, family(n)) for n in sizes]
+    growth = exponent(sizes, times)
+    bound = QUADRATIC_EXPONENT if family in QUADRATIC else TIME_EXPONENT
+    assert growth < bound, (family.__name__, times)
+
+
+@pytest.mark.parametrize('family,size', FAMILIES)
+def test_memory(parse, family, size):
+    sizes = [size*scale for scale in SCALES]
+    peaks = [peak_memory(parse, family(n)) for n in sizes]
+    growth = exponent(sizes, peaks)
+    assert growth < MEMORY_EXPONENT, (family.__name__, peaks)
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+import docutils.nodes
+from docutils.parsers.markdown import spans
+
+
+def test_table():
+    table = spans.SpanTable()
+    first = docutils.nodes.paragraph()
+    second = docutils.nodes.paragraph()
+    table.add(first, 1, 0, 2, 5)
+    table.add(second, 4, 2, 4, 9)
+    assert len(table) == 2
+    assert table.span(first) == (1, 0, 2, 5)
+    assert table.span(second) == (4, 2, 4, 9)
+    assert table.span(docutils.nodes.paragraph()) is None
+    table.add(first, 7, 0, 7, 1)
+    assert table.span(first) == (7, 0, 7, 1)
+
+
+def test_blocks(parse):
+    document = parse('# Title\n\nFirst line\nsecond line\n\n## Sub\n\n```\ncode\n```\n')
+    section = document[0]
+    title, paragraph, subsection = section.children
+    assert spans.get_span(section) == (1, 0, 10, 3)
+    assert spans.get_span(title) == (1, 0, 1, 7)
+    assert spans.get_span(paragraph) == (3, 0, 4, 11)
+    assert spans.get_span(subsection) == (6, 0, 10, 3)
+    assert spans.get_span(subsection[1]) == (8, 0, 10, 3)
+
+
+def test_inline(parse):
+    document = parse('Some `code`\nand *emphasis* here\n')
+    paragraph = document[0]
+    literal = paragraph.next_node(docutils.nodes.literal)
+    emphasis = paragraph.next_node(docutils.nodes.emphasis)
+    assert spans.get_span(literal) == (1, 5, 1, 11)
+    assert spans.get_span(emphasis) == (2, 4, 2, 14)
+
+
+def test_quotes(parse):
+    document = parse('> - > x\n>   > y\n\n# A\n\n> # B\n')
+    quote = document[0]
+    item = quote.next_node(docutils.nodes.list_item)
+    inner = item.next_node(docutils.nodes.block_quote)
+    assert [text.astext() for text in inner[0].children] == ['x', 'y']
+    assert spans.get_span(inner[0]) == (1, 6, 2, 7)
+    section = document[1]
+    assert section.next_node(docutils.nodes.block_quote)[0]['names'] == ['b']
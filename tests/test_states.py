@@ -0,0 +1,102 @@
+from __future__ import unicode_literals
+
+import docutils.nodes
+import docutils.statemachine
+import docutils.utils
+from docutils.parsers.markdown import states
+import pytest
+
+
+def lines():
+    return docutils.statemachine.StringList(
+        ['zero', 'one', '', 'three', 'four'], source='test')
+
+
+def test_line_view():
+    view = states.LineView(lines(), 1)
+    nested = states.LineView(view, 2)
+    assert isinstance(view, docutils.statemachine.StringList)
+    assert len(view) == 4
+    assert list(view) == ['one', '', 'three', 'four']
+    assert view.data == ['one', '', 'three', 'four']
+    assert len(view.items) == 4
+    assert view[0] == 'one'
+    assert view[-1] == 'four'
+    assert view[1:3] == ['', 'three']
+    assert nested.start == 3
+    assert nested[0] == 'three'
+    assert view.info(0) == ('test', 1)
+    assert nested.source(1) == 'test'
+    assert list(view.get_text_block(0)) == ['one']
+    assert list(nested.get_text_block(0)) == ['three', 'four']
+
+
+def test_line_view_insert():
+    root = lines()
+    view = states.LineView(root, 1)
+    nested = states.LineView(view, 2)
+    assert nested.quote_markers(0) == ()
+    nested.insert(0, '> new', source='inserted')
+    assert root[3] == '> new'
+    assert view[2] == '> new'
+    assert nested.info(0) == ('inserted', 0)
+    assert nested.quote_markers(0) == (2,)
+    del nested[0]
+    assert list(root) == list(lines())
+
+
+def test_run_view():
+    document = docutils.utils.new_document('test')
+    state_machine = states.MarkdownStateMachine.create()
+    view = states.LineView(lines(), 3)
+    state_machine.run(view, 3, context=document)
+    assert state_machine.input_lines is view
+    assert document[0].astext() == 'threefour'
+
+
+def test_tight_list(parse):
+    document = parse('* a \\* and *em*\n* c\n')
+    items = document[0].children
+    assert all(isinstance(item[0], docutils.nodes.inline) for item in items)
+    assert items[0][0].astext() == 'a * and em'
+    assert '<Escaped>' not in document.pformat()
+
+
+def test_loose_list(parse):
+    document = parse('* a \\* and *em*\n\n* c\n')
+    items = document[0].children
+    assert all(isinstance(item[0], docutils.nodes.paragraph) for item in items)
+    assert items[0][0].astext() == 'a * and em'
+    assert all(child.parent is items[0][0] for child in items[0][0].children)
+    assert '<Escaped>' not in document.pformat()
+
+
+@pytest.mark.parametrize('text,code,after', [
+    ('```\ncode\n```\n', 'code', None),
+    ('```\ncode\n\nmore\n', 'code\n\nmore', None),
+    ('```\ncode\n`````\nafter\n', 'code', 'after'),
+    ('    a\n\n\n    b\nafter\n', 'a\n\n\nb', 'after'),
+])
+def test_code_block(parse, text, code, after):
+    document = parse(text)
+    assert isinstance(document[0], docutils.nodes.literal_block)
+    assert document[0].astext() == code
+    if after is None:
+        assert len(document) == 1
+    else:
+        assert document[1].astext() == after
+
+
+def test_code_block_in_list_item(parse):
+    document = parse('* item\n\n  ```\n  code\n  ```\n')
+    item = document[0][0]
+    assert isinstance(item[1], docutils.nodes.literal_block)
+    assert item[1].astext() == 'code'
+
+
+def test_code_block_in_quote(parse):
+    document = parse('> ```\n> code\n> ```\n')
+    quote = document[0]
+    assert isinstance(quote, docutils.nodes.block_quote)
+    assert isinstance(quote[0], docutils.nodes.literal_block)
+    assert quote[0].astext() == 'code'
@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+import gzip
+import io
+import json
+import xml.etree.ElementTree
+
+from docutils.parsers.markdown import writer
+import pytest
+
+TEXT = '''# Title
+
+Some *emphasis* & `code`.
+
+* One
+* Two "quoted"
+'''
+
+
+@pytest.fixture
+def document(parse):
+    return parse(TEXT)
+
+
+def output(document, **kwargs):
+    stream = io.BytesIO()
+    writer.write(document, stream, buffer_size=8, **kwargs)
+    return stream.getvalue()
+
+
+def test_pseudoxml(document):
+    assert output(document).decode('utf-8') == '{}\n'.format(document)
+
+
+def test_xml(document):
+    root = xml.etree.ElementTree.fromstring(output(document, format='xml'))
+    assert root.tag == 'document'
+    assert root.find('section/paragraph/emphasis').text == 'emphasis'
+    assert ''.join(root.find('section/paragraph').itertext()) == 'Some emphasis & code.'
+
+
+def test_jsonl(document):
+    records = [json.loads(line) for line in
+               output(document, format='jsonl').decode('utf-8').splitlines()]
+    assert records[0]['tagname'] == 'document'
+    assert records[0]['level'] == 0
+    assert records[1]['tagname'] == 'section'
+    assert records[1]['attributes']['ids'] == ['title']
+    assert {'level': 3, 'text': 'Title'} in records
+
+
+def test_gzip(document):
+    compressed = output(document, compress=True)
+    assert gzip.GzipFile(fileobj=io.BytesIO(compressed)).read() == output(document)
+
+
+def test_unknown_format(document):
+    with pytest.raises(ValueError):
+        output(document, format='html')